@@ -88,8 +88,10 @@ def _extract_features_parallel(features, generator, n_jobs=-1):
     logger.info("Extracting features using at most %s processes", n_jobs)
     generator.image.precompute_normalization()
 
-    # Split generator in chunks
-    generators = tuple(generator.split(n_chunks=n_jobs))
+    # Split generator in chunks. The workers load the image for each
+    # feature themselves, so the tiles do not need to carry a loaded image.
+    generators = tuple(
+        generator.split(n_chunks=n_jobs, share_image_cache=False))
 
     with ProcessPoolExecutor(max_workers=n_jobs) as executor:
         for feature in features:
@@ -129,26 +131,26 @@ def extract_feature(feature, generator):
     """
     logger.info("Computing feature %s with windows %s and arguments %s",
                 feature.__class__.__name__, feature.windows, feature.kwargs)
-    if not generator.loaded_itype == feature.base_image:
+    if generator.loaded_itype != feature.base_image:
         logger.info("Loading base image %s", feature.base_image)
         generator.load_image(feature.base_image, feature.windows)
+    elif not set(feature.windows).issubset(generator.loaded_windows):
+        logger.info("Loading base image %s", feature.base_image)
+        # Keep the data type the image was loaded with
+        generator.load_image(feature.base_image, feature.windows,
+                             dtype=generator.loaded_dtype)
 
     shape = generator.shape + (len(feature.windows), feature.size)
-    vector = np.ma.zeros((np.prod(shape[:-1]), feature.size), dtype=np.float32)
-    vector.mask = np.zeros_like(vector, dtype=bool)
-
-    size = vector.shape[0]
-    i = 0
-    for window in generator:
-        if window.shape[:2] not in feature.windows:
-            continue
-        if i % (size // 10 or 1) == 0:
-            logger.info("%s%% ready", 100 * i // size)
-        if window.mask.any():
-            vector.mask[i] = True
-        else:
-            vector[i] = feature(window)
-        i += 1
-
-    vector.shape = shape
+    # Indices that the generator skips remain masked
+    vector = np.ma.array(np.zeros(shape, dtype=np.float32), mask=True)
+
+    size = np.prod(generator.shape)
+    for n, (i, j) in enumerate(generator.indices()):
+        if n % (size // 10 or 1) == 0:
+            logger.info("%s%% ready", 100 * n // size)
+        for k, window_shape in enumerate(feature.windows):
+            window = generator[i, j, window_shape]
+            if not window.mask.any():
+                vector[i, j, k] = feature(window)
+
     return vector
@@ -1,6 +1,11 @@
 """Module providing a generator to iterate over the image."""
 import logging
-import math
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from operator import index as as_int
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 from .image import Image
 
@@ -59,6 +64,13 @@ class FullGenerator():
         Offset from the (0, 0) point (in number of steps).
     shape: tuple(int, int)
         Shape of the generator (in number of steps)
+    flatten_windows: bool
+        If True, iterating yields each window separately, otherwise it
+        yields a tuple with all windows at the same coordinates
+    valid_mask: numpy.ndarray, optional
+        Boolean array with the shape of the image that is True where the
+        image contains valid data. Iterating skips all indices where no
+        pixel in the step is valid.
 
     """
 
@@ -66,30 +78,49 @@ class FullGenerator():
                  image: Image,
                  step_size: tuple,
                  offset=(0, 0),
-                 shape=None):
+                 shape=None,
+                 flatten_windows=True,
+                 valid_mask=None):
         self.image = image
+        self.flatten_windows = flatten_windows
 
-        self.step_size = step_size
+        self.step_size = tuple(as_int(step) for step in step_size)
         self.offset = offset
+        self._step_r, self._step_c = self.step_size
+        self._half_step = tuple(step // 2 for step in self.step_size)
 
         if not shape:
             shape = tuple(
-                math.ceil(image.shape[i] / step_size[i]) for i in range(2))
+                -(-image.shape[i] // self.step_size[i]) for i in range(2))
         self.shape = shape
 
         self.crs = image.crs
         self.transform = image.scaled_transform(step_size)
 
+        self._valid = None
+        self._valid_ij = None
+        if valid_mask is not None:
+            self._set_valid(self._get_valid(valid_mask))
+
         # set using load_image
         self.loaded_itype = None
         self._image_cache = None
         self._windows = None
         self._padding = None
+        self._pad_r = self._pad_c = None
+        self._row_starts = None
+        self._col_starts = None
+        self._views = None
+        self._out_bufs = None
 
-    def load_image(self, itype, windows):
+    def load_image(self, itype, windows, reuse_buffers=False, dtype=None):
         """
         Load image with sufficient additional data to cover windows.
 
+        The image is stored as a C-contiguous array in (height, width) or
+        (height, width, channels) layout, so the pixels of a window row
+        and their channels are adjacent in memory.
+
         Parameters
         ----------
             itype: str
@@ -97,15 +128,134 @@ class FullGenerator():
             windows: list[tuple]
                 The list of tuples of window shapes that will be used
                 with this generator
+            reuse_buffers: bool
+                If True, windows are copied into a buffer that is allocated
+                once per window shape and reused for every window of that
+                shape, instead of returned as read-only views on the image.
+                A window is overwritten when the next window of the same
+                shape is requested, so it must be processed or copied first.
+            dtype: numpy.dtype, optional
+                Convert the image to dtype, e.g. numpy.float16, at the cost
+                of precision; integer types only for non-normalized images.
         """
-        self._windows = tuple(sorted(windows, reverse=True))
-        self._padding = tuple(
-            max(math.ceil(0.5 * w[i]) for w in windows) for i in range(2))
+        self._set_windows(windows)
 
         block = self._get_blocks()
         image = self.image.copy_block(block)
-        self._image_cache = image[itype]
+        image_cache = image[itype]
+        if dtype is not None:
+            image_cache = _astype(image_cache, dtype)
+        if not image_cache.flags.c_contiguous:
+            image_cache = image_cache.copy(order='C')
+
+        self._set_image_cache(itype, image_cache, reuse_buffers)
+
+    @property
+    def loaded_windows(self):
+        """The window shapes loaded with load_image."""
+        return self._windows
+
+    @property
+    def loaded_dtype(self):
+        """The data type of the image loaded with load_image."""
+        return None if self._image_cache is None else self._image_cache.dtype
+
+    def _set_windows(self, windows):
+        """Set the window shapes and the padding needed to cover them."""
+        # Windows are used as keys, so they need to be hashable
+        windows = [tuple(as_int(n) for n in window) for window in windows]
+        self._windows = tuple(sorted(windows, reverse=True))
+        self._padding = tuple(
+            max((w[i] + 1) // 2 for w in windows) for i in range(2))
+        self._pad_r, self._pad_c = self._padding
+
+        # Window start positions in the image cache for all indices
+        row_mids = (self._pad_r + self._half_step[0] +
+                    np.arange(self.shape[0], dtype=np.intp) * self._step_r)
+        col_mids = (self._pad_c + self._half_step[1] +
+                    np.arange(self.shape[1], dtype=np.intp) * self._step_c)
+        self._row_starts = {w: row_mids - w[0] // 2 for w in self._windows}
+        self._col_starts = {w: col_mids - w[1] // 2 for w in self._windows}
+
+    def _set_image_cache(self, itype, image_cache, reuse_buffers):
+        """
+        Set the loaded image and everything derived from it.
+
+        Parameters
+        ----------
+            itype: str
+                Image type
+            image_cache: numpy.ma.masked_array
+                The image covering the generator including padding
+            reuse_buffers: bool
+                Whether to copy windows into reused buffers
+        """
+        self._image_cache = image_cache
         self.loaded_itype = itype
+        self._set_views(reuse_buffers)
+
+    def _set_views(self, reuse_buffers):
+        """
+        Create the window views on the image cache and the window buffers.
+
+        Parameters
+        ----------
+            reuse_buffers: bool
+                Whether to copy windows into reused buffers
+        """
+        self._views = {
+            window: _sliding_windows(self._image_cache, window)
+            for window in self._windows
+        }
+
+        self._out_bufs = None
+        if reuse_buffers:
+            channels = self._image_cache.shape[2:]
+            self._out_bufs = {
+                window: np.ma.MaskedArray(
+                    np.empty(window + channels, self._image_cache.dtype),
+                    mask=np.zeros(window + channels, dtype=bool),
+                    fill_value=self._image_cache.fill_value)
+                for window in self._windows
+            }
+
+    def __getstate__(self):
+        """Leave out the window views and buffers when pickling.
+
+        Pickling a sliding window view copies every window, so the views
+        are recreated from the image cache after unpickling instead.
+        """
+        state = self.__dict__.copy()
+        state['_views'] = None
+        state['_out_bufs'] = None
+        state['_reuse_buffers'] = self._out_bufs is not None
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the window views and buffers after unpickling."""
+        reuse_buffers = state.pop('_reuse_buffers')
+        self.__dict__.update(state)
+        if self._image_cache is not None:
+            self._set_views(reuse_buffers)
+
+    def _share_image_cache(self, parent):
+        """
+        Use the part of the image loaded by parent that covers this generator.
+
+        Parameters
+        ----------
+            parent: FullGenerator
+                Loaded generator that covers this generator, e.g. the
+                generator this generator was split from
+        """
+        self._set_windows(parent._windows)
+        row = (self.offset[0] - parent.offset[0]) * self._step_r
+        col = (self.offset[1] - parent.offset[1]) * self._step_c
+        rows = self.shape[0] * self._step_r + 2 * self._pad_r
+        cols = self.shape[1] * self._step_c + 2 * self._pad_c
+        image_cache = parent._image_cache[row:row + rows, col:col + cols]
+        self._set_image_cache(parent.loaded_itype, image_cache,
+                              parent._out_bufs is not None)
 
     def _get_blocks(self):
         """
@@ -122,34 +272,35 @@ class FullGenerator():
 
         return tuple(block)
 
-    def _get_slices(self, index, window):
+    def _get_valid(self, valid_mask):
         """
-        Calculate the array slices needed to retrieve the window from the image
-        at the provided index
+        Calculate which indices of the generator contain valid data.
 
         Parameters
         ----------
-            index:  1-D array-like
-                The x and y coordinates for the slice in steps
-            window: 1-D array-like
-                The x and y size of the window
+            valid_mask: numpy.ndarray
+                Boolean array with the shape of the image
 
         Returns
         -------
-            tuple[tuple]
-                The x-range and y-range slices for the index and
-                window both with and without the padding included
+            numpy.ndarray
+                Boolean array with the shape of the generator
         """
-        slices = []
-
-        for i in range(2):
-            mid = self._padding[i] + math.floor(
-                (index[i] + .5) * self.step_size[i])
-            start = mid - math.floor(.5 * window[i])
-            end = start + window[i]
-            slices.append(slice(start, end))
-
-        return slices
+        shape = (self.shape[0] * self._step_r, self.shape[1] * self._step_c)
+        row = self.offset[0] * self._step_r
+        col = self.offset[1] * self._step_c
+        valid = np.asarray(valid_mask, dtype=bool)[row:row + shape[0],
+                                                   col:col + shape[1]]
+        # Pad the part outside of the image, so it can be reshaped into steps
+        valid = np.pad(valid, ((0, shape[0] - valid.shape[0]),
+                               (0, shape[1] - valid.shape[1])))
+        return valid.reshape(self.shape[0], self._step_r, self.shape[1],
+                             self._step_c).any(axis=(1, 3))
+
+    def _set_valid(self, valid):
+        """Set the indices of the generator that contain valid data."""
+        self._valid = valid
+        self._valid_ij = np.argwhere(valid).tolist()
 
     def __iter__(self):
         """
@@ -159,7 +310,11 @@ class FullGenerator():
         by the step_size the part of the image as defined by the window.
 
         Consecutive calls will first return each window and then move to the
-        next coordinates
+        next coordinates. If the generator was created with
+        flatten_windows=False, all windows at the same coordinates are
+        returned together as a tuple, in the order of the loaded windows.
+        If the generator was created with a valid_mask, the coordinates
+        without valid data are skipped.
 
         Returns
         -------
@@ -167,10 +322,148 @@ class FullGenerator():
         """
         if self._image_cache is None:
             raise RuntimeError("Please load an image first using load_image.")
-        for i in range(self.shape[0]):
-            for j in range(self.shape[1]):
-                for window in self._windows:
-                    yield self[i, j, window]
+
+        out_bufs = self._out_bufs or {}
+        # Python ints are faster to index with than NumPy scalars
+        starts = tuple((self._views[window],
+                        self._row_starts[window].tolist(),
+                        self._col_starts[window].tolist(),
+                        out_bufs.get(window))
+                       for window in self._windows)
+        for i, j in self.indices():
+            windows = []
+            for view, row_starts, col_starts, out in starts:
+                window = view[row_starts[i], col_starts[j]]
+                if out is not None:
+                    window = _copy_window(window, out)
+                windows.append(window)
+            if self.flatten_windows:
+                yield from windows
+            else:
+                yield tuple(windows)
+
+    def indices(self):
+        """
+        Iterate over the x and y coordinates visited by iterating.
+
+        Returns
+        -------
+            collections.Iterable[tuple(int, int)]
+                All coordinates of the generator, or only the coordinates
+                with valid data if the generator has a valid_mask
+        """
+        if self._valid_ij is None:
+            return product(range(self.shape[0]), range(self.shape[1]))
+        return map(tuple, self._valid_ij)
+
+    def as_array(self, window):
+        """
+        View the windows at all indices of the generator as a single array.
+
+        Because the window start positions are evenly spaced, this is a
+        strided view on the cached image instead of a copy: no data is
+        moved and no per window slices are created. Iteration over all
+        windows is possible with ``arr.reshape(-1, *arr.shape[2:])``,
+        which does copy the data.
+
+        Parameters
+        ----------
+            window: tuple(int, int)
+                The shape of the windows, one of the windows supplied to
+                load_image
+
+        Returns
+        -------
+            numpy.ma.masked_array
+                Read-only array of shape
+                (shape[0], shape[1], window[0], window[1], ...)
+                where element [i, j] is the window at index i, j
+        """
+        if self._image_cache is None:
+            raise RuntimeError("Please load an image first using load_image.")
+
+        row_start = self._row_starts[window][0]
+        col_start = self._col_starts[window][0]
+        view = self._views[window][row_start::self.step_size[0],
+                                   col_start::self.step_size[1]]
+        return view[:self.shape[0], :self.shape[1]]
+
+    def extract_all(self, window):
+        """
+        Extract the windows at all indices of the generator at once.
+
+        Parameters
+        ----------
+            window: tuple(int, int)
+                The shape of the windows, one of the windows supplied to
+                load_image
+
+        Returns
+        -------
+            numpy.ma.masked_array
+                Array of shape (shape[0], shape[1], window[0], window[1], ...)
+                containing a copy of the window at each index
+        """
+        return self.as_array(window).copy()
+
+    def batches(self, window, batch_size=1024, prefetch=False):
+        """
+        Iterate over the windows of a single shape in batches.
+
+        Windows are returned in the same order as by iterating over the
+        generator, but copied into one array per batch. If the generator
+        has a valid_mask, the coordinates without valid data are skipped.
+
+        Parameters
+        ----------
+            window: tuple(int, int)
+                The shape of the windows, one of the windows supplied to
+                load_image
+            batch_size: int
+                The maximum number of windows per batch
+            prefetch: bool
+                If True, the next batch is extracted in a background thread
+                while the current batch is being processed
+
+        Returns
+        -------
+            collections.Iterable[tuple(numpy.ndarray, numpy.ma.masked_array)]
+                For each batch, an array of shape (n, 2) with the x and y
+                coordinates of the windows and an array of shape
+                (n, window[0], window[1], ...) with the windows
+        """
+        windows = self.as_array(window)
+        if self._valid_ij is None:
+            valid_ij = None
+            n_windows = self.shape[0] * self.shape[1]
+        else:
+            valid_ij = np.array(self._valid_ij, dtype=np.intp).reshape(-1, 2)
+            n_windows = len(valid_ij)
+
+        def get_batch(start):
+            stop = min(start + batch_size, n_windows)
+            if valid_ij is None:
+                rows, cols = np.divmod(np.arange(start, stop), self.shape[1])
+                indices = np.stack((rows, cols), axis=1)
+            else:
+                indices = valid_ij[start:stop]
+            return indices, windows[indices[:, 0], indices[:, 1]]
+
+        starts = range(0, n_windows, batch_size)
+        if not prefetch:
+            for start in starts:
+                yield get_batch(start)
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            for start in starts:
+                future = executor.submit(get_batch, start)
+                if pending is not None:
+                    yield pending.result()
+                pending = future
+            if pending is not None:
+                yield pending.result()
 
     def __getitem__(self, index):
         """
@@ -180,35 +473,113 @@ class FullGenerator():
         ----------
             index: 1-D array-like
                 An array wich specifies the x and y coordinates
-                and the window shape to get from the generator
+                and the window shape to get from the generator.
+                The window shape must be one of the windows supplied
+                to load_image.
+
+        Returns
+        -------
+            numpy.ma.masked_array
+                Read-only view on the window, or, if the image was loaded
+                with reuse_buffers=True, the buffer for the window shape,
+                which is overwritten by the next call for that shape
 
         Examples:
         ---------
         >>> generator[0, 0, (100, 100)]
         """
         window = index[2]
-
-        slices = self._get_slices(index, window)
-
-        return self._image_cache[slices[0], slices[1]]
-
-    def split(self, n_chunks):
+        row = self._row_starts[window][index[0]]
+        col = self._col_starts[window][index[1]]
+        if self._out_bufs is not None:
+            return _copy_window(self._views[window][row, col],
+                                self._out_bufs[window])
+        return self._views[window][row, col]
+
+    def split(self, n_chunks, n_col_chunks=1, share_image_cache=True):
         """
         Split processing into chunks.
 
+        The image is split into tiles of n_chunks by n_col_chunks.
+        Splitting along both axes keeps the image data needed to process
+        a single tile small, so it can stay in the CPU cache while all
+        windows of the tile are processed. Tiles are yielded row by row.
+
         Parameters
         ----------
             n_chunks: int
-                Number of chunks to split the image into
-        """
-        chunk_size = math.ceil(self.shape[0] / n_chunks)
-        for job in range(n_chunks):
-            row_offset = self.offset[0] + job * chunk_size
-            row_length = min(chunk_size, self.shape[0] - row_offset)
-            if row_length <= 0:
-                break
-            yield FullGenerator(
-                image=self.image,
-                step_size=self.step_size,
-                offset=(row_offset, self.offset[1]),
-                shape=(row_length, self.shape[1]))
+                Number of chunks to split the rows of the image into
+            n_col_chunks: int
+                Number of chunks to split the columns of the image into
+            share_image_cache: bool
+                If True and an image has been loaded, the tiles share the
+                loaded image instead of reading their part of it again
+        """
+        row_chunk = -(-self.shape[0] // n_chunks)
+        col_chunk = -(-self.shape[1] // n_col_chunks)
+        for row in range(0, self.shape[0], row_chunk):
+            row_length = min(row_chunk, self.shape[0] - row)
+            for col in range(0, self.shape[1], col_chunk):
+                col_length = min(col_chunk, self.shape[1] - col)
+                generator = FullGenerator(
+                    image=self.image,
+                    step_size=self.step_size,
+                    offset=(self.offset[0] + row, self.offset[1] + col),
+                    shape=(row_length, col_length),
+                    flatten_windows=self.flatten_windows)
+                if self._valid is not None:
+                    generator._set_valid(
+                        self._valid[row:row + row_length,
+                                    col:col + col_length])
+                if share_image_cache and self._image_cache is not None:
+                    generator._share_image_cache(self)
+                yield generator
+
+
+def _astype(array, dtype):
+    """Convert a masked array to dtype with a fill value valid for dtype."""
+    dtype = np.dtype(dtype)
+    fill_value = None
+    if dtype.kind == 'f':
+        fill_value = np.finfo(dtype).max
+    elif dtype.kind in 'iu':
+        fill_value = np.iinfo(dtype).max
+    return np.ma.MaskedArray(
+        np.ma.getdata(array).astype(dtype, copy=False),
+        mask=np.ma.getmaskarray(array),
+        fill_value=fill_value)
+
+
+def _copy_window(window, out):
+    """Copy the data and mask of window into the buffer out."""
+    np.copyto(out.data, window.data)
+    np.copyto(out.mask, window.mask)
+    return out
+
+
+def _sliding_windows(array, window):
+    """
+    Create a read-only view on all windows of the given shape in array.
+
+    Parameters
+    ----------
+        array: numpy.ndarray or numpy.ma.masked_array
+            Image array with the spatial dimensions first
+        window: tuple(int, int)
+            The shape of the window
+
+    Returns
+    -------
+        numpy.ma.masked_array
+            Array of shape (rows, cols, window[0], window[1], ...) where
+            element [r, c] is the window with its top left corner at r, c
+    """
+    data = _window_view(np.ma.getdata(array), window)
+    mask = _window_view(np.ma.getmaskarray(array), window)
+    return np.ma.MaskedArray(data, mask=mask, fill_value=array.fill_value)
+
+
+def _window_view(array, window):
+    """Sliding window view with window axes in front of any channel axes."""
+    view = sliding_window_view(array, window, axis=(0, 1))
+    return np.moveaxis(view, (-2, -1), (2, 3))
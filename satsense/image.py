@@ -12,6 +12,7 @@ import numpy as np
 import rasterio
 from affine import Affine
 from netCDF4 import Dataset
+from rasterio.windows import Window
 from skimage import img_as_ubyte
 from skimage.color import gray2rgb, rgb2gray
 
@@ -242,9 +243,21 @@ class Image:
         logger.info("Loading band %s from file %s", band, self.filename)
         bandno = self.bands[band] + 1
         with rasterio.open(self.filename) as dataset:
-            image = dataset.read(
-                bandno, window=block, boundless=True, masked=True)
-            return image
+            if block is None:
+                return dataset.read(bandno, masked=True)
+            ranges = block.toranges() if isinstance(block, Window) else block
+            if np.any(np.mod(ranges, 1)):
+                # rasterio resamples blocks that are not aligned to pixels
+                return dataset.read(
+                    bandno, window=block, boundless=True, masked=True)
+            # Read the part inside the image and pad the rest as masked,
+            # this is much faster than a boundless read
+            block, pad_width = _clip_block(ranges, dataset.shape)
+            image = dataset.read(bandno, window=block, masked=True)
+        data = np.pad(image.data, pad_width)
+        mask = np.pad(np.ma.getmaskarray(image), pad_width,
+                      constant_values=True)
+        return np.ma.array(data, mask=mask, fill_value=image.fill_value)
 
     def precompute_normalization(self, *bands):
         """
@@ -391,6 +404,45 @@ class Image:
         return self.transform * Affine.scale(*step_size)
 
 
+def _clip_block(block, shape):
+    """
+    Clip a block to the image and compute the padding to restore its size.
+
+    Parameters
+    ----------
+    block: tuple or rasterio.windows.Window
+        The part of the image defined in a rasterio compatible way
+    shape: tuple(int, int)
+        The shape of the image
+
+    Returns
+    -------
+    tuple(tuple, numpy.ndarray)
+        The block clipped to the image as ((row_start, row_stop),
+        (col_start, col_stop)) and the number of values to add before and
+        after each axis, as used by numpy.pad
+
+    Raises
+    ------
+    ValueError:
+        If the block is not aligned to pixels
+    """
+    if isinstance(block, Window):
+        block = block.toranges()
+    if np.any(np.mod(block, 1)):
+        raise ValueError(
+            "Block {} is not aligned to pixels".format(block))
+    block = np.array(block, dtype=np.intp)
+    clipped = np.clip(block, 0, np.array(shape)[:, np.newaxis])
+
+    size = block[:, 1] - block[:, 0]
+    before = np.clip(-block[:, 0], 0, size)
+    after = size - before - (clipped[:, 1] - clipped[:, 0])
+    pad_width = np.stack((before, after), axis=1)
+
+    return tuple(map(tuple, clipped.tolist())), pad_width
+
+
 def get_rgb_image(image: Image):
     """
     Convert the image to rgb format.
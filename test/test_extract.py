@@ -5,7 +5,7 @@ import pytest
 from hypothesis import given, settings
 
 from satsense.bands import BANDS
-from satsense.extract import extract_features
+from satsense.extract import extract_feature, extract_features
 from satsense.features import Feature
 from satsense.generators import FullGenerator
 
@@ -94,3 +94,62 @@ def test_extract_features_parallel(generator, n_jobs):
         np.testing.assert_array_almost_equal_nulp(
             result.vector[~result.vector.mask],
             reference.vector[~reference.vector.mask])
+
+
+def test_extract_feature_valid_mask(generator):
+    """Test that indices without valid data are masked in the result."""
+    window_shapes = ((3, 3), )
+    feature = GrayscaleFeature(window_shapes)
+    generator.image.precompute_normalization()
+    reference = extract_feature(feature, generator)
+
+    valid_mask = np.zeros(generator.image.shape, dtype=bool)
+    valid_mask[6:] = True
+    masked = FullGenerator(generator.image, generator.step_size,
+                           valid_mask=valid_mask)
+    parts = [extract_feature(feature, masked)]
+    masked.load_image(feature.base_image, window_shapes)
+    parts.extend(extract_feature(feature, gen) for gen in masked.split(2))
+    result = np.ma.vstack(parts[1:])
+
+    for vector in parts[0], result:
+        assert vector.shape == reference.shape
+        assert vector.mask[:2].all()
+        np.testing.assert_array_equal(vector.mask[2:], reference.mask[2:])
+        np.testing.assert_array_equal(vector[2:], reference[2:])
+
+
+def test_extract_features_valid_mask_parallel(generator):
+    """Test that a valid mask gives the same result in parallel."""
+    features = [
+        GrayscaleFeature(window_shapes=((3, 3), )),
+        RGBFeature(window_shapes=((2, 2), )),
+    ]
+    valid_mask = np.zeros(generator.image.shape, dtype=bool)
+    valid_mask[:5, 4:] = True
+    generator = FullGenerator(generator.image, generator.step_size,
+                              valid_mask=valid_mask)
+
+    references = list(extract_features(features, generator, n_jobs=1))
+    results = list(extract_features(features, generator, n_jobs=2))
+
+    for reference, result in zip(references, results):
+        assert reference.vector.mask[2:].all()
+        assert not reference.vector.mask.all()
+        np.testing.assert_array_equal(result.vector.mask,
+                                      reference.vector.mask)
+        np.testing.assert_array_equal(result.vector, reference.vector)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_extract_features_grouped_windows(generator, n_jobs):
+    """Test that features can be computed with grouped windows."""
+    features = [GrayscaleFeature(window_shapes=((3, 3), (5, 5)))]
+    reference, = extract_features(features, generator, n_jobs=1)
+
+    grouped = FullGenerator(generator.image, generator.step_size,
+                            flatten_windows=False)
+    result, = extract_features(features, grouped, n_jobs=n_jobs)
+
+    np.testing.assert_array_equal(result.vector.mask, reference.vector.mask)
+    np.testing.assert_array_equal(result.vector, reference.vector)
@@ -1,3 +1,6 @@
+import math
+import pickle
+
 import hypothesis.strategies as st
 import numpy as np
 import pytest
@@ -386,6 +389,89 @@ def test_full_generator_windows(tmpdir):
     assert not np.any(windows[3].mask[:3, :3])
 
 
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+@pytest.mark.parametrize('dtype', [np.float16, np.float32, np.uint8])
+def test_full_generator_dtype(tmpdir, dtype):
+    """Test converting an image that is not normalized to dtype."""
+    satellite = 'quickbird'
+    shape = (len(BANDS[satellite]), 5, 5)
+    array = np.arange(np.prod(shape), dtype=float).reshape(shape)
+
+    image = create_test_image(tmpdir, array, normalization=False)
+    generator = FullGenerator(image, (3, 3))
+    generator.load_image('blue', ((3, 3), ), dtype=dtype)
+
+    windows = list(generator)
+    assert len(windows) == 4
+    for window in windows:
+        assert window.dtype == dtype
+        window.filled()
+    assert windows[0][1, 1] == array[0, 1, 1]
+
+
+def test_full_generator_valid_mask(tmpdir):
+    satellite = 'quickbird'
+    shape = (len(BANDS[satellite]), 7, 5)
+    array = np.arange(np.prod(shape), dtype=float).reshape(shape)
+
+    image = create_test_image(tmpdir, array, normalization=False)
+    valid_mask = np.zeros(shape[1:], dtype=bool)
+    valid_mask[1, 2] = True
+    valid_mask[6, 4] = True
+    generator = FullGenerator(image, (3, 2), valid_mask=valid_mask)
+    assert generator.shape == (3, 3)
+
+    generator.load_image('blue', ((3, 3), ))
+    windows = list(generator)
+
+    assert len(windows) == 2
+    np.testing.assert_array_equal(windows[0], generator[0, 1, (3, 3)])
+    np.testing.assert_array_equal(windows[1], generator[2, 2, (3, 3)])
+
+    batches = list(generator.batches((3, 3), batch_size=1))
+    assert [indices.tolist() for indices, _ in batches] == [[[0, 1]],
+                                                            [[2, 2]]]
+    for (_, batch), window in zip(batches, windows):
+        np.testing.assert_array_equal(batch[0], window)
+
+    generator.load_image('red', ((2, 2), ))
+    assert len(list(generator)) == 2
+
+    for gen in generator.split(3):
+        assert gen._valid.shape == gen.shape
+        gen.load_image('blue', ((3, 3), ))
+        assert len(list(gen)) == (0 if gen.offset[0] == 1 else 1)
+
+
+@pytest.mark.parametrize('reuse_buffers', [False, True])
+def test_full_generator_pickle(tmpdir, reuse_buffers):
+    """Test that pickling a loaded generator does not copy all windows."""
+    satellite = 'quickbird'
+    shape = (len(BANDS[satellite]), 40, 40)
+    array = np.arange(np.prod(shape), dtype=float).reshape(shape)
+
+    image = create_test_image(tmpdir, array, normalization=False)
+    generator = FullGenerator(image, (2, 2))
+    generator.load_image('blue', ((10, 10), ),
+                         reuse_buffers=reuse_buffers)
+    reference = [window.copy() for window in generator]
+
+    for gen in (generator, *generator.split(2)):
+        cache = gen._image_cache
+        assert len(pickle.dumps(gen)) < 2 * (cache.nbytes + cache.mask.nbytes)
+
+    for gen in generator.split(2, share_image_cache=False):
+        assert gen.loaded_itype is None
+        assert len(pickle.dumps(gen)) < 2 * cache.nbytes
+
+    restored = pickle.loads(pickle.dumps(generator))
+    assert restored.loaded_windows == generator.loaded_windows
+    assert sum(1 for _ in restored) == len(reference)
+    for window, ref in zip(restored, reference):
+        np.testing.assert_array_equal(ref.mask, window.mask)
+        np.testing.assert_array_equal(ref[~ref.mask], window[~window.mask])
+
+
 st_window_shape = st.tuples(
     st.integers(min_value=1, max_value=10),
     st.integers(min_value=1, max_value=10))
@@ -430,6 +516,7 @@ def test_full_generator(tmpdir, window_shapes, step_and_image):
     itype = 'grayscale'
     generator.load_image(itype, window_shapes)
     assert generator.loaded_itype == itype
+    assert generator._image_cache.flags.c_contiguous
 
     windows = []
     for window in generator:
@@ -437,6 +524,103 @@ def test_full_generator(tmpdir, window_shapes, step_and_image):
         windows.append(window)
     assert np.prod(generator.shape) == len(windows) // len(window_shapes)
 
+    generator.flatten_windows = False
+    fused = list(generator)
+    assert len(fused) == np.prod(generator.shape)
+    for k, window_tuple in enumerate(fused):
+        assert len(window_tuple) == len(window_shapes)
+        for n, window in enumerate(window_tuple):
+            reference = windows[k * len(window_shapes) + n]
+            np.testing.assert_array_equal(reference.mask, window.mask)
+            np.testing.assert_array_equal(reference[~reference.mask],
+                                          window[~window.mask])
+
+    # Window starts as computed before they were precomputed per window
+    pad_r, pad_c = generator._padding
+    i, j = generator.shape[0] - 1, generator.shape[1] - 1
+    for window_shape in window_shapes:
+        row_starts = [
+            pad_r + math.floor((n + 0.5) * step_size[0]) - window_shape[0] // 2
+            for n in range(generator.shape[0])
+        ]
+        col_starts = [
+            pad_c + math.floor((n + 0.5) * step_size[1]) - window_shape[1] // 2
+            for n in range(generator.shape[1])
+        ]
+        assert generator._row_starts[window_shape].tolist() == row_starts
+        assert generator._col_starts[window_shape].tolist() == col_starts
+
+        row, col = row_starts[i], col_starts[j]
+        reference = generator._image_cache[row:row + window_shape[0],
+                                           col:col + window_shape[1]]
+        window = generator[i, j, window_shape]
+        np.testing.assert_array_equal(reference.mask, window.mask)
+        np.testing.assert_array_equal(reference[~reference.mask],
+                                      window[~window.mask])
+
+
+@given(st_window_shapes, st_step_and_image)
+def test_full_generator_reuse_buffers(tmpdir, window_shapes, step_and_image):
+    step_size, image_array = step_and_image
+
+    image = create_test_image(tmpdir, image_array, normalization=False)
+    generator = FullGenerator(image, step_size)
+    generator.load_image('grayscale', window_shapes)
+    reference = [window.copy() for window in generator]
+
+    generator.load_image('grayscale', window_shapes, reuse_buffers=True)
+    buffers = {}
+    for window, ref in zip(generator, reference):
+        assert buffers.setdefault(window.shape, window) is window
+        np.testing.assert_array_equal(ref.mask, window.mask)
+        np.testing.assert_array_equal(ref[~ref.mask], window[~window.mask])
+
+
+@given(st_window_shapes, st_step_and_image)
+def test_full_generator_extract_all(tmpdir, window_shapes, step_and_image):
+    step_size, image_array = step_and_image
+
+    image = create_test_image(tmpdir, image_array, normalization=False)
+    generator = FullGenerator(image, step_size)
+    generator.load_image('grayscale', window_shapes)
+    reference = list(generator)
+
+    for k, window_shape in enumerate(generator._windows):
+        windows = generator.extract_all(window_shape)
+        assert windows.shape == generator.shape + window_shape
+        view = generator.as_array(window_shape)
+        assert np.shares_memory(view.data, generator._image_cache.data)
+        np.testing.assert_array_equal(view.mask, windows.mask)
+        expected = reference[k::len(window_shapes)]
+        for window, ref in zip(windows.reshape(-1, *window_shape), expected):
+            np.testing.assert_array_equal(ref.mask, window.mask)
+            np.testing.assert_array_equal(ref[~ref.mask], window[~window.mask])
+
+
+@given(st_window_shapes, st_step_and_image,
+       st.integers(min_value=1, max_value=10), st.booleans())
+def test_full_generator_batches(tmpdir, window_shapes, step_and_image,
+                                batch_size, prefetch):
+    step_size, image_array = step_and_image
+
+    image = create_test_image(tmpdir, image_array, normalization=False)
+    generator = FullGenerator(image, step_size)
+    generator.load_image('grayscale', window_shapes)
+
+    for window_shape in window_shapes:
+        reference = generator.extract_all(window_shape)
+        n_windows = 0
+        for indices, windows in generator.batches(window_shape, batch_size,
+                                                  prefetch):
+            assert 0 < len(indices) <= batch_size
+            assert windows.shape == (len(indices), ) + window_shape
+            expected = reference[indices[:, 0], indices[:, 1]]
+            np.testing.assert_array_equal(expected.mask, windows.mask)
+            np.testing.assert_array_equal(expected[~expected.mask],
+                                          windows[~windows.mask])
+            n_windows += len(indices)
+        assert n_windows == np.prod(generator.shape)
+
 
 @given(st_window_shapes, st_step_and_image,
        st.integers(min_value=1, max_value=5))
@@ -461,3 +645,46 @@ def test_full_generator_split(tmpdir, window_shapes, step_and_image, n_chunks):
                                       window[~window.mask])
 
     assert len(reference) == len(windows)
+
+
+@given(st_window_shapes, st_step_and_image,
+       st.integers(min_value=1, max_value=5),
+       st.integers(min_value=1, max_value=5))
+@settings(deadline=1000)
+def test_full_generator_split_2d(tmpdir, window_shapes, step_and_image,
+                                 n_row_chunks, n_col_chunks):
+    step_size, image_array = step_and_image
+
+    image = create_test_image(tmpdir, image_array, normalization=False)
+    generator = FullGenerator(image, step_size)
+    itype = 'grayscale'
+    generator.load_image(itype, window_shapes)
+
+    n_windows = 0
+    for gen in generator.split(n_chunks=n_row_chunks,
+                               n_col_chunks=n_col_chunks):
+        gen.load_image(itype, window_shapes)
+        rows = slice(gen.offset[0], gen.offset[0] + gen.shape[0])
+        cols = slice(gen.offset[1], gen.offset[1] + gen.shape[1])
+        for window_shape in window_shapes:
+            reference = generator.as_array(window_shape)[rows, cols]
+            windows = gen.as_array(window_shape)
+            np.testing.assert_array_equal(reference.mask, windows.mask)
+            np.testing.assert_allclose(reference[~reference.mask],
+                                       windows[~windows.mask],
+                                       rtol=1e-6)
+        n_windows += np.prod(gen.shape)
+
+    for gen in generator.split(n_row_chunks, n_col_chunks):
+        assert gen.loaded_itype == itype
+        assert np.shares_memory(gen._image_cache, generator._image_cache)
+        rows = slice(gen.offset[0], gen.offset[0] + gen.shape[0])
+        cols = slice(gen.offset[1], gen.offset[1] + gen.shape[1])
+        for window_shape in window_shapes:
+            reference = generator.as_array(window_shape)[rows, cols]
+            windows = gen.as_array(window_shape)
+            np.testing.assert_array_equal(reference.mask, windows.mask)
+            np.testing.assert_array_equal(reference[~reference.mask],
+                                          windows[~windows.mask])
+
+    assert n_windows == np.prod(generator.shape)
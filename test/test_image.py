@@ -5,8 +5,9 @@ import pytest
 import rasterio
 from hypothesis import given
 from netCDF4 import Dataset
+from rasterio.windows import Window
 
-from satsense.image import FeatureVector
+from satsense.image import FeatureVector, _clip_block
 
 from .test_extract import RGBFeature
 from .test_generators import st_window_shape as st_image_shape
@@ -110,3 +111,39 @@ def test_normalization_partial_fails(image):
         partial_image.precompute_normalization()
         msg = str(exc.value)
         assert "Unable to compute normalization on part of the image." in msg
+
+
+@pytest.mark.parametrize('block, clipped, pad_width', [
+    (((0, 4), (0, 5)), ((0, 4), (0, 5)), [[0, 0], [0, 0]]),
+    (((-2, 3), (1, 7)), ((0, 3), (1, 5)), [[2, 0], [0, 2]]),
+    (((-3, -1), (6, 9)), ((0, 0), (5, 5)), [[2, 0], [0, 3]]),
+    (Window(1, -2, 6, 5), ((0, 3), (1, 5)), [[2, 0], [0, 2]]),
+])
+def test_clip_block(block, clipped, pad_width):
+    """Test that a clipped and padded block has the size of the block."""
+    result, result_pad_width = _clip_block(block, (4, 5))
+    assert result == clipped
+    np.testing.assert_array_equal(result_pad_width, pad_width)
+
+
+def test_clip_block_fractional():
+    """Test that a block that is not aligned to pixels is rejected."""
+    with pytest.raises(ValueError):
+        _clip_block(Window(0.5, 0.5, 10.2, 10.2), (4, 5))
+
+
+@pytest.mark.parametrize('block', [
+    ((-3, 20), (150, 160)),
+    Window(-2, 140, 20, 15),
+    Window(0.5, 0.5, 10.2, 10.2),
+    Window(-2.5, -1.5, 10.2, 10.7),
+])
+def test_read_band_block(image, block):
+    """Test that reading a block gives the same result as a boundless read."""
+    band = 'blue'
+    result = image._read_band(band, block)
+    with rasterio.open(image.filename) as dataset:
+        reference = dataset.read(image.bands[band] + 1, window=block,
+                                 boundless=True, masked=True)
+    np.testing.assert_array_equal(result.mask, reference.mask)
+    np.testing.assert_array_equal(result.compressed(), reference.compressed())